@@ -1,5 +1,7 @@
+from threading import Lock
 import numpy as np
 import google.generativeai as genai
+from batcher import TechGuideEmbeddingBatcher
 from cards import TechGuideCards
 from decouple import config
 
@@ -9,13 +11,26 @@ class TechGuideAI:
     TechGuide AI Class
     """
 
+    # Embedding batchers shared by all the instances, one per embedding model and
+    # batching configuration, so that concurrent plans are coalesced together
+    _batchers = {}
+    _batchers_lock = Lock()
+
     def __init__(
-        self, embedding_model="models/embedding-001", generative_model="gemini-1.0-pro"
+        self,
+        embedding_model="models/embedding-001",
+        generative_model="gemini-1.0-pro",
+        batch_window=0.01,
+        max_batch_size=32,
+        max_concurrency=4,
     ):
         """
         Constructor
         :param embedding_model:
         :param generative_model:
+        :param batch_window: Seconds an embedding request waits for concurrent ones
+        :param max_batch_size: Maximum number of contents embedded in one call
+        :param max_concurrency: Maximum number of embedding calls in flight
         """
         API_KEY = config("API_KEY")
 
@@ -23,28 +38,67 @@ class TechGuideAI:
         self.embedding_model = embedding_model
         self.model = genai.GenerativeModel(generative_model)
 
-    def embed_content(self, content):
+        key = (embedding_model, batch_window, max_batch_size, max_concurrency)
+        with TechGuideAI._batchers_lock:
+            if key not in TechGuideAI._batchers:
+                TechGuideAI._batchers[key] = TechGuideEmbeddingBatcher(
+                    lambda contents: self.embed_contents(contents),
+                    max_batch_size=max_batch_size,
+                    max_wait=batch_window,
+                    max_concurrency=max_concurrency,
+                )
+            self.batcher = TechGuideAI._batchers[key]
+
+    @staticmethod
+    def close_batchers():
+        """
+        Stop the shared embedding batchers and their threads
+        :return:
         """
-        Embed content
-        :param content:
+        with TechGuideAI._batchers_lock:
+            batchers = list(TechGuideAI._batchers.values())
+            TechGuideAI._batchers = {}
+        for batcher in batchers:
+            batcher.close()
+
+    def embed_contents(self, contents):
+        """
+        Embed a list of contents in a single call
+        :param contents:
         :return:
         """
         return genai.embed_content(
-            model=self.embedding_model, content=content, task_type="classification"
+            model=self.embedding_model, content=contents, task_type="classification"
         )["embedding"]
 
-    def search_similar_cards(self, cards, content, quantity=3):
+    def embed_content(self, content):
+        """
+        Embed content, coalescing concurrent requests into batch calls.
+        A list of contents is embedded directly in a single call.
+        :param content:
+        :return:
+        """
+        if isinstance(content, (list, tuple)):
+            return self.embed_contents(list(content))
+        return self.batcher.embed(content)
+
+    def search_similar_cards(self, cards, content, quantity=3, diversity=0.0):
         """
         Search similar cards
         :param cards:
         :param content:
         :param quantity:
+        :param diversity: Weight of the diversity in the maximal marginal relevance
+        selection, 0 keeps the most similar cards
         :return:
         """
         content_embedding = self.embed_content(content)
         product = np.dot(cards.embeddings, content_embedding)
-        indexes = np.argsort(product)[::-1]
-        near_indexes = indexes[:quantity]
+        if diversity > 0:
+            near_indexes = cards.select_diverse(product, quantity, diversity)
+        else:
+            indexes = np.argsort(product)[::-1]
+            near_indexes = indexes[:quantity]
 
         return TechGuideCards([cards.cards[i] for i in near_indexes])
 
@@ -0,0 +1,112 @@
+"""
+Coalescing of concurrent embedding requests.
+
+Requests arriving within a short window, or until a maximum batch size is reached,
+are sent to the backend as a single batch call and the vectors are fanned back out
+to the waiting callers.
+"""
+
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Thread
+from typing import Callable, List
+
+
+class TechGuideEmbeddingBatcher:
+    """
+    Micro-batching of embedding requests
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[List[str]], List[List[float]]],
+        max_batch_size: int = 32,
+        max_wait: float = 0.01,
+        max_concurrency: int = 4,
+    ):
+        """
+
+        :param embed_batch: Backend embedding a list of contents, one vector per content
+        :param max_batch_size: Maximum number of contents sent in one backend call
+        :param max_wait: Maximum time in seconds a request waits for others to join its batch
+        :param max_concurrency: Maximum number of backend calls in flight
+        """
+        self.embed_batch = embed_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_concurrency = max_concurrency
+        self._pending = []
+        self._condition = Condition()
+        self._executor = None
+        self._dispatcher = None
+        self._closed = False
+
+    def embed(self, content: str) -> List[float]:
+        """
+        Embed a content, blocking until its batch is processed
+        :param content:
+        :return:
+        """
+        if not isinstance(content, str):
+            raise TypeError(f"Content must be a str, got {type(content).__name__}")
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Embedding batcher is closed")
+            if self._dispatcher is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+                self._dispatcher = Thread(target=self._dispatch, daemon=True)
+                self._dispatcher.start()
+            self._pending.append((content, future, time.monotonic()))
+            self._condition.notify()
+        return future.result()
+
+    def close(self):
+        """
+        Send the pending requests, then stop the dispatcher and the backend threads
+        :return:
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.join()
+            self._executor.shutdown(wait=True)
+
+    def _dispatch(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    return
+                deadline = self._pending[0][2] + self.max_wait
+                while len(self._pending) < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch = self._pending[: self.max_batch_size]
+                del self._pending[: self.max_batch_size]
+            self._executor.submit(self._send, batch)
+
+    def _send(self, batch):
+        # Every future must be resolved, otherwise its caller blocks forever
+        try:
+            # Identical contents (e.g. the same job description) are embedded once
+            contents = list(dict.fromkeys(content for content, _, _ in batch))
+            embeddings = self.embed_batch(contents)
+            if len(embeddings) != len(contents):
+                raise ValueError(
+                    f"Expected {len(contents)} embeddings, got {len(embeddings)}"
+                )
+            vectors = dict(zip(contents, embeddings))
+        except Exception as e:
+            logging.exception(f"Error embedding a batch of {len(batch)} contents")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for content, future, _ in batch:
+            future.set_result(vectors[content])
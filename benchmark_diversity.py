@@ -0,0 +1,87 @@
+"""
+Latency of the cards selection for growing synthetic catalogs.
+
+Compares the pure relevance top-k, the maximal marginal relevance selection backed
+by the precomputed neighbors table and a maximal marginal relevance selection that
+computes the similarity of each selected card against the whole catalog.
+"""
+
+import time
+from argparse import ArgumentParser
+import numpy as np
+from cards import TechGuideCard, TechGuideCards
+
+
+def synthetic_cards(size, dimension, top_n, rng):
+    embeddings = rng.normal(size=(size, dimension)).astype(np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    cards = [
+        TechGuideCard(card_id=f"card-{i}", embedding=embeddings[i])
+        for i in range(size)
+    ]
+    # The table content does not change the latency, only its shape does
+    neighbors = {
+        f"card-{i}": [
+            (f"card-{j}", float(rng.random()))
+            for j in rng.choice(size, top_n, replace=False)
+        ]
+        for i in range(size)
+    }
+    return TechGuideCards(cards, neighbors=neighbors)
+
+
+def top_k(cards, relevance, quantity):
+    return list(np.argsort(relevance)[::-1][:quantity])
+
+
+def full_mmr(cards, relevance, quantity, diversity):
+    penalty = np.zeros(len(cards.cards))
+    available = np.ones(len(cards.cards), dtype=bool)
+    selected = []
+    for _ in range(quantity):
+        score = (1 - diversity) * relevance - diversity * penalty
+        score[~available] = -np.inf
+        i = int(np.argmax(score))
+        selected.append(i)
+        available[i] = False
+        penalty = np.maximum(penalty, cards.embeddings @ cards.embeddings[i])
+    return selected
+
+
+def timeit(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser("TechGuide AI - Diversity benchmark")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", help="Catalog sizes", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--dimension", type=int, help="Embedding dimension", default=768)
+    parser.add_argument("--top_n", type=int, help="Neighbors per card", default=10)
+    parser.add_argument("--availability", type=int, help="Number of cards", default=8)
+    parser.add_argument("--diversity", type=float, help="Diversity weight", default=0.3)
+    parser.add_argument("--repeat", type=int, help="Repetitions", default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'size':>8} | {'top-k':>10} | {'mmr table':>10} | {'mmr full':>10}")
+    for size in args.sizes:
+        cards = synthetic_cards(size, args.dimension, args.top_n, rng)
+        query = rng.normal(size=args.dimension).astype(np.float32)
+        relevance = cards.embeddings @ query
+
+        plain = timeit(lambda: top_k(cards, relevance, args.availability), args.repeat)
+        table = timeit(
+            lambda: cards.select_diverse(relevance, args.availability, args.diversity),
+            args.repeat,
+        )
+        full = timeit(
+            lambda: full_mmr(cards, relevance, args.availability, args.diversity),
+            args.repeat,
+        )
+        print(f"{size:>8} | {plain:>8.2f}ms | {table:>8.2f}ms | {full:>8.2f}ms")
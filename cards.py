@@ -1,7 +1,17 @@
+import os
 import json
-from typing import List
+import heapq
+import logging
+from typing import Callable, Dict, List, Tuple
 import numpy as np
-from parameters import CARDS_FILE, CARDS_EMBEDDINGS_FILE
+from parameters import (
+    CARDS_FILE,
+    CARDS_EMBEDDINGS_FILE,
+    CARDS_NEIGHBORS_FILE,
+    DEFAULT_LANGUAGE,
+    check_language,
+    shard_file,
+)
 
 
 class TechGuideContent:
@@ -76,9 +86,163 @@ class TechGuideCard:
 
 class TechGuideCards:
 
-    def __init__(self, cards: List[TechGuideCard]):
+    def __init__(
+        self,
+        cards: List[TechGuideCard],
+        neighbors: Dict[str, List[Tuple[str, float]]] = None,
+    ):
         self.cards = cards
-        self.embeddings = np.array([card.embedding for card in cards])
+        self.embeddings = self.embedding_matrix()
+        self.neighbors = neighbors if neighbors else {}
+        self.neighbors_size = max(
+            (len(items) for items in self.neighbors.values()), default=0
+        )
+        self._subscribers = []
+
+    def embedding_matrix(self) -> np.ndarray:
+        """
+        Card embeddings as a float matrix, cards without embedding become zero rows
+        :return:
+        """
+        dimension = max(
+            (len(card.embedding) for card in self.cards if card.embedding is not None),
+            default=0,
+        )
+        matrix = np.zeros((len(self.cards), dimension))
+        for i, card in enumerate(self.cards):
+            if card.embedding is not None and len(card.embedding):
+                matrix[i] = card.embedding
+        return matrix
+
+    def build_neighbors(self, top_n: int = 10, block_size: int = 1024):
+        """
+        Top-N most similar cards of each card, by cosine similarity.
+        Similarities are computed by blocks of rows to bound memory usage.
+        :param top_n: Number of neighbors kept per card
+        :param block_size: Number of cards compared to the whole catalog at once
+        :return: Neighbors as {card_id: [(neighbor_id, similarity), ...]}
+        """
+        matrix = self.embeddings
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+        top_n = min(top_n, len(self.cards) - 1)
+
+        neighbors = {}
+        if top_n <= 0:
+            return neighbors
+        for start in range(0, len(self.cards), block_size):
+            similarities = matrix[start : start + block_size] @ matrix.T
+            for i, row in enumerate(similarities, start=start):
+                if norms[i, 0] == 0:
+                    continue
+                row[i] = -np.inf
+                indexes = np.argpartition(row, -top_n)[-top_n:]
+                indexes = indexes[np.argsort(row[indexes])[::-1]]
+                neighbors[self.cards[i].card_id] = [
+                    (self.cards[j].card_id, float(row[j]))
+                    for j in indexes
+                    if norms[j, 0] > 0
+                ]
+        return neighbors
+
+    def select_diverse(self, relevance: np.ndarray, quantity: int, diversity: float):
+        """
+        Maximal marginal relevance selection using the precomputed neighbors table.
+        The score of a card is (1 - diversity) * relevance - diversity * similarity to
+        the closest selected card, where only neighbors of selected cards are penalized.
+        At most quantity * N cards are ever penalized, so the selection is exact within
+        the quantity * (N + 1) most relevant cards, and scores only decrease, so a
+        lazy max-heap rescores only the popped cards whose penalty changed.
+        :param relevance: Relevance of each card to the query
+        :param quantity: Number of cards to select
+        :param diversity: Weight of the diversity, between 0 and 1, 0 keeps the pure
+        relevance order
+        :return: Selected indexes, in selection order
+        """
+        if not 0 <= diversity <= 1:
+            raise ValueError(f"Diversity must be between 0 and 1, got {diversity}")
+        if quantity <= 0 or len(self.cards) == 0:
+            return []
+        if diversity > 0 and not self.neighbors:
+            logging.warning(
+                "Cards neighbors table is empty, diversity is ignored. "
+                "Run the collector to build cards_neighbors.json."
+            )
+        size = min(len(self.cards), quantity * (self.neighbors_size + 1))
+        candidates = np.argpartition(relevance, len(relevance) - size)[-size:]
+        candidate_index = {
+            self.cards[i].card_id: position for position, i in enumerate(candidates)
+        }
+        penalty = np.zeros(size)
+        heap = [
+            (-(1 - diversity) * relevance[i], position, 0.0)
+            for position, i in enumerate(candidates)
+        ]
+        heapq.heapify(heap)
+
+        selected = []
+        while heap and len(selected) < quantity:
+            _, position, seen_penalty = heapq.heappop(heap)
+            if penalty[position] != seen_penalty:
+                i = candidates[position]
+                score = (1 - diversity) * relevance[i] - diversity * penalty[position]
+                heapq.heappush(heap, (-score, position, penalty[position]))
+                continue
+            i = candidates[position]
+            selected.append(int(i))
+            for neighbor_id, similarity in self.neighbors.get(
+                self.cards[i].card_id, []
+            ):
+                j = candidate_index.get(neighbor_id)
+                if j is not None and similarity > penalty[j]:
+                    penalty[j] = similarity
+        return selected
+
+    def subscribe(self, callback: Callable[["TechGuideCards", int], None]):
+        """
+        Register a callback called with this catalog whenever an embedding changes,
+        along with the index of the changed card, or None when the whole embeddings
+        matrix was rebuilt. Registering the same callback again has no effect.
+        :param callback:
+        :return: Callable removing the subscription
+        """
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+        return lambda: self.unsubscribe(callback)
+
+    def unsubscribe(self, callback: Callable[["TechGuideCards", int], None]):
+        """
+        Remove a callback registered with subscribe, if present
+        :param callback:
+        :return:
+        """
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def update_embedding(self, card_id: str, embedding: List[float]):
+        """
+        Replace the embedding of a card, updating its row of the embeddings matrix in
+        place, and notify the subscribers
+        :param card_id:
+        :param embedding: New embedding, None removes the card embedding
+        :return:
+        """
+        for i, card in enumerate(self.cards):
+            if card.card_id == card_id:
+                break
+        else:
+            raise KeyError(card_id)
+        card.embedding = embedding
+        changed = i
+        if embedding is None or len(embedding) == 0:
+            self.embeddings[i] = 0
+        elif len(embedding) == self.embeddings.shape[1]:
+            self.embeddings[i] = embedding
+        else:
+            self.embeddings = self.embedding_matrix()
+            changed = None
+        for callback in self._subscribers:
+            callback(self, changed)
 
     def __str__(self):
         return "\n\n".join([str(card) for card in self.cards])
@@ -112,13 +276,48 @@ class TechGuideCards:
         return "\n".join(prompt_array)
 
     @staticmethod
-    def construct(file: str = CARDS_FILE, embeddings_file: str = CARDS_EMBEDDINGS_FILE):
+    def construct(
+        *,
+        language: str = DEFAULT_LANGUAGE,
+        file: str = None,
+        embeddings_file: str = None,
+        neighbors_file: str = None,
+    ):
+        """
+        Read the cards catalog of a language. Shards are loaded on first use and kept
+        in a bounded cache, unless explicit files are given.
+        :param language: Shard language
+        :param file: Cards file, defaults to the language shard
+        :param embeddings_file: Cards embeddings file, defaults to the language shard
+        :param neighbors_file: Cards neighbors file, defaults to the language shard
+        :return:
+        """
+        check_language(language)
+        if file is None and embeddings_file is None and neighbors_file is None:
+            # Imported here since the shards module builds on this one
+            from shards import load_shard
+
+            return load_shard(language).cards
+        return TechGuideCards.read(
+            file=file or shard_file(CARDS_FILE, language),
+            embeddings_file=embeddings_file
+            or shard_file(CARDS_EMBEDDINGS_FILE, language),
+            neighbors_file=neighbors_file or shard_file(CARDS_NEIGHBORS_FILE, language),
+        )
+
+    @staticmethod
+    def read(file: str, embeddings_file: str, neighbors_file: str = None):
         with open(file, "r") as f:
             card_data = json.load(f)
 
         with open(embeddings_file, "r") as f:
             embeddings = json.load(f)
 
+        neighbors = {}
+        if neighbors_file and os.path.exists(neighbors_file):
+            with open(neighbors_file, "r") as f:
+                neighbors = json.load(f)
+
         cards = []
         for card_id, item in card_data.items():
 
@@ -159,7 +358,7 @@ class TechGuideCards:
                 embedding=embeddings.get(card_id, []),
             )
             cards.append(card)
-        return TechGuideCards(cards)
+        return TechGuideCards(cards, neighbors=neighbors)
 
     def filter_cards_by_id_and_priority(self, similar_expertises, max_cards=25):
         similar_expertises_cards = []
@@ -174,5 +373,7 @@ class TechGuideCards:
             [list(card.keys())[0] for card in similar_expertises_cards[:max_cards]]
         )
         return TechGuideCards(
-            [card for card in self.cards if card.card_id in filtered_cards_ids]
+            [card for card in self.cards if card.card_id in filtered_cards_ids],
+            neighbors=self.neighbors,
         )
+
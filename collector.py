@@ -2,22 +2,46 @@
 Esse módulo permite baixar e processar os dados do repositório techguide do GitHub.
 Como resultado teremos os cards e os paths em uma estrutura de dados a ser utilizada
 posteriormente pelo TechGuideAI. Além disso, é feito o embedding dos cards e dos guides.
+
+A coleta é feita como um pipeline: a leitura dos arquivos acontece em paralelo com as
+chamadas de embedding, por meio de filas limitadas. O progresso é registrado em um
+journal, permitindo retomar a coleta caso o processo seja interrompido.
 """
 
 import os
+import shutil
+from argparse import ArgumentParser
 from urllib.request import urlopen
 import yaml
 from yaml.scanner import ScannerError
 from google.api_core.exceptions import DeadlineExceeded
 import json
 import logging
+from queue import Queue
+from threading import Thread
 
 from io import BytesIO
 from zipfile import ZipFile
 import google.generativeai as genai
 from retry import retry
-
-from parameters import API_KEY, DATA_FOLDER, TMP_FOLDER, TECHGUIDE_GITHUB, BRANCH_NAME
+from decouple import config
+
+from cards import TechGuideCards
+from journal import TechGuideJournal, atomic_writer
+from paths import TechGuidePaths, guide_card_id
+from parameters import (
+    DATA_FOLDER,
+    TMP_FOLDER,
+    TECHGUIDE_GITHUB,
+    BRANCH_NAME,
+    LANGUAGES,
+    CARDS_FILE,
+    CARDS_EMBEDDINGS_FILE,
+    CARDS_NEIGHBORS_FILE,
+    GUIDES_FILE,
+    GUIDES_EMBEDDINGS_FILE,
+    shard_file,
+)
 
 logging.basicConfig(level=logging.INFO)
 
@@ -33,13 +57,19 @@ class TechGuideCollector:
         branch=BRANCH_NAME,
         tmp_folder=TMP_FOLDER,
         data_folder=DATA_FOLDER,
+        languages=LANGUAGES,
+        workers=4,
+        queue_size=16,
     ):
         """
 
         :param techguide_github: String that represents the GitHub repository in the format owner/repo
         :param branch: Git branch to download
         :param tmp_folder: Temporary folder to download the repository
-        :param data_folder: Data folder to store the processed data
+        :param data_folder: Data folder to store the processed data, one shard per language
+        :param languages: Languages to collect
+        :param workers: Number of threads calling the embedding API
+        :param queue_size: Maximum number of items waiting between pipeline stages
         """
 
         # Isolaring owner and repo
@@ -55,6 +85,11 @@ class TechGuideCollector:
         self.tmp_folder = tmp_folder
         self.download_folder = os.path.join(tmp_folder, f"{repo}-{branch}")
         self.data_folder = data_folder
+        self.languages = languages
+        self.journal_file = os.path.join(tmp_folder, "collector_journal.sqlite")
+        self.journal = None
+        self.workers = workers
+        self.queue_size = queue_size
 
     def download_repo(self, force=False):
         """
@@ -62,33 +97,26 @@ class TechGuideCollector:
         :param force: Force download even if the folder already exists
         :return:
         """
-        if force or os.path.exists(self.download_folder):
-            logging.warning(
-                f"Folder {self.download_folder} already exists. Skipping download_repo."
-            )
-            return
+        if os.path.exists(self.download_folder):
+            if not force:
+                logging.warning(
+                    f"Folder {self.download_folder} already exists. Skipping download_repo."
+                )
+                return
+            shutil.rmtree(self.download_folder)
         http_response = urlopen(self.url)
         with ZipFile(BytesIO(http_response.read())) as zipfile:
             zipfile.extractall(path=self.tmp_folder)
 
-    def collecting_guides(self, force=False):
+    def collecting_guides(self):
         """
-
-        :param languages:
-        :param force:
-        :return:
+        Parse the guides files one at a time
+        :return: Iterator of (language, guide_id, guide)
         """
 
         path = os.path.join(self.download_folder, f"_data/guides")
         for language in os.listdir(path):
-            if language != "pt_BR":
-                continue
-            data = {}
-            destination = os.path.join(self.data_folder, "guides.json")
-            if not force and os.path.exists(destination):
-                logging.warning(
-                    f"Guides file {destination} already exists. Skipping collecting."
-                )
+            if language not in self.languages:
                 continue
 
             for file in os.listdir(os.path.join(path, language)):
@@ -99,13 +127,32 @@ class TechGuideCollector:
                     logging.error(f"Error processing card {file}")
                     continue
 
-                logging.info(f"Processing guide {file}")
+                logging.info(f"Processing guide {language}/{file}")
+                yield language, file.rsplit(".", 1)[0], guide
 
-                guide_id = file.rsplit(".", 1)[0]
-                data[guide_id] = guide
+    def collecting_cards(self):
+        """
+        Parse the cards files one at a time
+        :return: Iterator of (language, card_id, card)
+        """
+
+        path = os.path.join(self.download_folder, f"_data/cards")
+        for language in os.listdir(path):
+            if language not in self.languages:
+                continue
+
+            logging.info(f"Processing language {language}")
+            for file in os.listdir(os.path.join(path, language)):
+                try:
+                    with open(os.path.join(path, language, file), "r") as f:
+                        card = yaml.load(f, Loader=yaml.FullLoader)
+                except ScannerError:
+                    logging.error(f"Error processing card {file}")
+                    continue
 
-            with open(destination, "w") as f:
-                json.dump(data, f)
+                logging.info(f"Processing card {language}/{file}")
+                yield language, file.rsplit(".", 1)[0], card
+            logging.info(f"Processing language {language}: done.")
 
     @retry(DeadlineExceeded, tries=3, delay=15)
     def embed_card(self, card: dict, model: str):
@@ -133,112 +180,291 @@ class TechGuideCollector:
         )
         return output["embedding"]
 
-    def collecting_cards(self, languages=("pt_BR",), force=False):
-
-        path = os.path.join(self.download_folder, f"_data/cards")
-        for language in os.listdir(path):
-            if language not in languages:
+    def embed_guide_layers(self, guide: dict, cards: dict, model: str):
+        """
+        Embed every expertise and collaboration layer of a guide
+        :param guide: Guide data
+        :param cards: Cards of the guide, by card id
+        :param model: Embedding model
+        :return:
+        """
+        data = {}
+        for component in ("expertise", "collaboration"):
+            data[component] = []
+            for guide_item in guide[component]:
+                expertise_cards = {}
+                for guide_card in guide_item["cards"]:
+                    card_id = guide_card_id(guide_card)
+                    if card_id in cards:
+                        expertise_cards[card_id] = cards[card_id]
+                data[component].append(self.embed_guide(expertise_cards, model))
+        return data
+
+    def _pipeline(self, producer, worker):
+        """
+        Run a producer thread feeding worker threads through bounded queues, while
+        the calling thread records every result in the journal as soon as it arrives.
+        :param producer: Callable receiving a reading journal, the tasks queue and
+        the results queue. Tasks are processed by worker, results of the form
+        (stage, key, value) are recorded directly.
+        :param worker: Callable turning a task into a (stage, key, value) result
+        :return:
+        """
+        tasks = Queue(maxsize=self.queue_size)
+        results = Queue(maxsize=self.queue_size)
+        errors = []
+
+        def produce():
+            journal = TechGuideJournal(self.journal_file)
+            try:
+                producer(journal, tasks, results)
+            except Exception as e:
+                logging.exception("Error producing collector tasks")
+                errors.append(e)
+            finally:
+                journal.close()
+                for _ in range(self.workers):
+                    tasks.put(None)
+
+        def work():
+            try:
+                while True:
+                    task = tasks.get()
+                    if task is None:
+                        break
+                    try:
+                        results.put(worker(task))
+                    except Exception as e:
+                        logging.exception("Error processing collector task")
+                        errors.append(e)
+            finally:
+                results.put(None)
+
+        threads = [Thread(target=produce, daemon=True)]
+        threads += [Thread(target=work, daemon=True) for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        finished = 0
+        while finished < self.workers:
+            result = results.get()
+            if result is None:
+                finished += 1
                 continue
+            stage, key, value = result
+            self.journal.record(stage, key, value)
 
-            data = {}
-            destination = os.path.join(self.data_folder, "cards.json")
-            if not force and os.path.exists(destination):
-                logging.warning(
-                    f"Card file {destination} already exists. Skipping collecting."
-                )
-                continue
+        for thread in threads:
+            thread.join()
 
-            logging.info(f"Processing language {language}")
-            for file in os.listdir(os.path.join(path, language)):
-                try:
-                    with open(os.path.join(path, language, file), "r") as f:
-                        card = yaml.load(f, Loader=yaml.FullLoader)
-                except ScannerError:
-                    logging.error(f"Error processing card {file}")
-                    continue
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} collector items failed. "
+                f"Run the collector again to resume from {self.journal_file}."
+            ) from errors[0]
 
-                logging.info(f"Processing card {file}")
-                data[file.rsplit(".", 1)[0]] = card
+    def collecting_and_embedding_cards(self, model="models/embedding-001"):
+        """
+        Parse the guides and the cards and embed the cards, skipping what the
+        journal already holds.
+        :param model: Embedding model
+        :return:
+        """
 
-            with open(destination, "w") as f:
-                json.dump(data, f)
-            logging.info(f"Processing language {language}: done.")
+        def producer(journal, tasks, results):
+            for language, guide_id, guide in self.collecting_guides():
+                if not journal.done(f"{language}/guide", guide_id):
+                    results.put((f"{language}/guide", guide_id, guide))
+            for language, card_id, card in self.collecting_cards():
+                if not journal.done(f"{language}/card", card_id):
+                    results.put((f"{language}/card", card_id, card))
+                if not journal.done(f"{language}/card_embedding", card_id):
+                    tasks.put((language, card_id, card))
 
-    def embedding_cards(self, model="models/embedding-001", force=False):
+        def worker(task):
+            language, card_id, card = task
+            logging.info(f"Embedding card {language}/{card_id}")
+            return f"{language}/card_embedding", card_id, self.embed_card(card, model)
 
-        for language in os.listdir(self.data_folder):
-            destination = os.path.join(
-                self.data_folder, "cards_embedding.json"
-            )
-            if not force and os.path.exists(destination):
-                logging.warning(
-                    f"Embedding file {destination} already exists. Skipping embedding."
-                )
-                continue
+        self._pipeline(producer, worker)
 
-            with open(os.path.join(self.data_folder, language, "cards.json"), "r") as f:
-                cards = json.load(f)
+    def embedding_guides(self, model="models/embedding-001"):
+        """
+        Embed the layers of the journaled guides, skipping the ones already done
+        :param model: Embedding model
+        :return:
+        """
 
-            data = {}
-            for key, card in cards.items():
-                logging.info(f"Processing card {key}")
-                data[key] = self.embed_card(card, model)
+        def producer(journal, tasks, results):
+            for language in self.languages:
+                for guide_id, guide in journal.items(f"{language}/guide"):
+                    if journal.done(f"{language}/guide_embedding", guide_id):
+                        continue
+                    cards = {}
+                    for component in ("expertise", "collaboration"):
+                        for guide_item in guide[component]:
+                            for guide_card in guide_item["cards"]:
+                                card_id = guide_card_id(guide_card)
+                                card = journal.get(f"{language}/card", card_id)
+                                if card is not None:
+                                    cards[card_id] = card
+                    tasks.put((language, guide_id, guide, cards))
+
+        def worker(task):
+            language, guide_id, guide, cards = task
+            logging.info(f"Embedding guide {language}/{guide_id}")
+            return f"{language}/guide_embedding", guide_id, self.embed_guide_layers(
+                guide, cards, model
+            )
 
-            with open(destination, "w") as f:
-                json.dump(data, f)
+        self._pipeline(producer, worker)
 
-            logging.info(f"Processing language {language}: done.")
+    def collected_languages(self):
+        """
+        Languages with both guides and cards in the journal
+        :return:
+        """
+        return [
+            language
+            for language in self.languages
+            if next(self.journal.keys(f"{language}/guide"), None) is not None
+            and next(self.journal.keys(f"{language}/card"), None) is not None
+        ]
+
+    def writing_outputs(self, language, derive_guides=False):
+        """
+        Write the shard files of a language from the journal, each one replaced
+        atomically
+        :param language: Shard language
+        :param derive_guides: Skip guides_embedding.json, derived afterwards
+        :return:
+        """
+        os.makedirs(os.path.join(self.data_folder, language), exist_ok=True)
+        outputs = [
+            ("guide", GUIDES_FILE),
+            ("card", CARDS_FILE),
+            ("card_embedding", CARDS_EMBEDDINGS_FILE),
+        ]
+        if not derive_guides:
+            outputs.append(("guide_embedding", GUIDES_EMBEDDINGS_FILE))
+        for stage, file in outputs:
+            destination = shard_file(file, language, self.data_folder)
+            self.journal.dump(f"{language}/{stage}", destination)
+            logging.info(f"Writing {destination}: done.")
+
+    def deriving_guides_embedding(self, language):
+        """
+        Compute the guides embeddings from the cards embeddings, without calling the
+        embedding API. Each layer is the priority-weighted, normalized aggregate of
+        its cards embeddings.
+        :param language: Shard language
+        :return:
+        """
+        destination = shard_file(GUIDES_EMBEDDINGS_FILE, language, self.data_folder)
 
-    def embedding_guides(self, model="models/embedding-001", force=False):
+        cards = TechGuideCards.read(
+            file=shard_file(CARDS_FILE, language, self.data_folder),
+            embeddings_file=shard_file(CARDS_EMBEDDINGS_FILE, language, self.data_folder),
+        )
+        paths = TechGuidePaths.read(
+            file=shard_file(GUIDES_FILE, language, self.data_folder),
+            embeddings_file=destination,
+            cards=cards,
+        )
 
-        for language in os.listdir(self.data_folder):
-            destination = os.path.join(
-                self.data_folder, "guides_embedding.json"
-            )
-            if not force and os.path.exists(destination):
-                logging.warning(
-                    f"Embedding file {destination} already exists. Skipping embedding."
+        with atomic_writer(destination) as f:
+            f.write("{")
+            for i, path in enumerate(paths.paths):
+                if i:
+                    f.write(", ")
+                f.write(json.dumps(path.path_id))
+                f.write(": ")
+                json.dump(
+                    {
+                        "expertise": path.expertises_embeddings.tolist(),
+                        "collaboration": path.collaborations_embeddings.tolist(),
+                    },
+                    f,
                 )
-                continue
-
-            with open(os.path.join(self.data_folder, language, "cards.json"), "r") as f:
-                cards = json.load(f)
+            f.write("}")
 
-            with open(
-                os.path.join(self.data_folder, language, "guides.json"), "r"
-            ) as f:
-                guides = json.load(f)
+        logging.info(f"Deriving guides embedding {language}: done.")
 
-            data = {}
-            for guide_key, guide in guides.items():
-                logging.info(f"Processing guide {guide_key}")
-                data[guide_key] = {}
-
-                for component in ("expertise", "collaboration"):
-                    data[guide_key][component] = []
+    def building_cards_neighbors(self, language, top_n=10):
+        """
+        Compute the table of the most similar cards of each card, used to diversify
+        the cards selection at query time
+        :param language: Shard language
+        :param top_n: Number of neighbors kept per card
+        :return:
+        """
+        destination = shard_file(CARDS_NEIGHBORS_FILE, language, self.data_folder)
 
-                    for i, guide_item in enumerate(guide[component]):
-                        expertise_cards = {}
-                        for guide_card in guide_item["cards"]:
-                            card_id = list(guide_card.keys())[0]
-                            if card_id in cards:
-                                expertise_cards[card_id] = cards[card_id]
-                        embedding = self.embed_guide(expertise_cards, model)
-                        data[guide_key][component].append(embedding)
+        cards = TechGuideCards.read(
+            file=shard_file(CARDS_FILE, language, self.data_folder),
+            embeddings_file=shard_file(CARDS_EMBEDDINGS_FILE, language, self.data_folder),
+        )
+        neighbors = cards.build_neighbors(top_n=top_n)
 
-            with open(destination, "w") as f:
-                json.dump(data, f)
+        with atomic_writer(destination) as f:
+            json.dump(neighbors, f)
 
-            logging.info(f"Processing language {language}: done.")
+        logging.info(f"Building cards neighbors {language}: done.")
 
-def collector():
-    genai.configure(api_key=API_KEY)
+    def run(self, model="models/embedding-001", derive_guides=False, force=False):
+        """
+        Collect and embed the techguide data, resuming from the journal
+        :param model: Embedding model
+        :param derive_guides: Derive the guides embeddings from the cards embeddings
+        instead of embedding the guides through the API
+        :param force: Discard the journal and the download and start from scratch
+        :return:
+        """
+        self.journal = TechGuideJournal(self.journal_file)
+        try:
+            if force:
+                self.journal.reset()
+            self.download_repo(force=force)
+            self.collecting_and_embedding_cards(model)
+            if not derive_guides:
+                self.embedding_guides(model)
+            languages = self.collected_languages()
+            for language in languages:
+                self.writing_outputs(language, derive_guides)
+        finally:
+            self.journal.close()
+        for language in languages:
+            if derive_guides:
+                self.deriving_guides_embedding(language)
+            self.building_cards_neighbors(language)
+
+
+def collector(derive_guides=False, force=False):
+    """
+    Download and process the techguide data
+    :param derive_guides: Derive the guides embeddings from the cards embeddings
+    instead of embedding the guides through the API
+    :param force: Discard the collected progress and the download and start from scratch
+    :return:
+    """
+    genai.configure(api_key=config("API_KEY"))
     c = TechGuideCollector()
-    c.download_repo()
-    c.collecting_guides()
-    c.embedding_guides()
-    c.collecting_cards()
-    c.embedding_cards()
+    c.run(derive_guides=derive_guides, force=force)
+
 
 if __name__ == "__main__":
-    collector()
+
+    parser = ArgumentParser("TechGuide AI - Collector")
+    parser.add_argument(
+        "--derive_guides",
+        action="store_true",
+        help="Derive the guides embeddings from the cards embeddings",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Discard the collected progress and the download and start from scratch",
+    )
+    args = parser.parse_args()
+
+    collector(derive_guides=args.derive_guides, force=args.force)
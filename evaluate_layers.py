@@ -0,0 +1,112 @@
+"""
+Compare the expertise layers embeddings computed through the embedding API
+(guides_embedding.json) with the ones derived locally from the cards embeddings.
+
+Each card embedding is used as a query: a good layer embedding should retrieve the
+layers that contain the card. Job descriptions can also be given to compare the
+top layers retrieved by both approaches.
+"""
+
+from argparse import ArgumentParser
+import numpy as np
+from cards import TechGuideCards
+from parameters import DEFAULT_LANGUAGE, LANGUAGES
+from paths import TechGuidePaths, guide_card_id
+
+
+def rank(layer_embeddings, query, k):
+    product = np.dot(layer_embeddings, query)
+    return list(np.argsort(product)[::-1][:k])
+
+
+def evaluate(cards, api_paths, derived_paths, k=4):
+    """
+    Retrieval metrics using the cards embeddings as queries
+    :param cards:
+    :param api_paths:
+    :param derived_paths:
+    :param k:
+    :return:
+    """
+    layers = api_paths.expertises
+    layer_cards = [
+        set(guide_card_id(guide_card) for guide_card in layer.cards) for layer in layers
+    ]
+
+    api_embeddings = api_paths.expertises_embeddings
+    derived_embeddings = derived_paths.expertises_embeddings
+
+    api_norms = np.linalg.norm(api_embeddings, axis=1)
+    derived_norms = np.linalg.norm(derived_embeddings, axis=1)
+    valid = (api_norms > 0) & (derived_norms > 0)
+    cosines = np.sum(api_embeddings * derived_embeddings, axis=1)[valid] / (
+        api_norms[valid] * derived_norms[valid]
+    )
+
+    api_hits, derived_hits, overlap, queries = 0, 0, 0, 0
+    for card in cards.cards:
+        if not card.embedding:
+            continue
+        relevant = {i for i, ids in enumerate(layer_cards) if card.card_id in ids}
+        if not relevant:
+            continue
+        api_top = rank(api_embeddings, card.embedding, k)
+        derived_top = rank(derived_embeddings, card.embedding, k)
+        api_hits += len(relevant.intersection(api_top)) / min(len(relevant), k)
+        derived_hits += len(relevant.intersection(derived_top)) / min(len(relevant), k)
+        overlap += len(set(api_top).intersection(derived_top)) / k
+        queries += 1
+
+    return {
+        "layers": len(layers),
+        "queries": queries,
+        "mean_cosine": float(np.mean(cosines)) if len(cosines) else 0.0,
+        "api_recall": api_hits / queries if queries else 0.0,
+        "derived_recall": derived_hits / queries if queries else 0.0,
+        "top_overlap": overlap / queries if queries else 0.0,
+    }
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser("TechGuide AI - Layers embedding evaluation")
+    parser.add_argument("--k", type=int, help="Number of retrieved layers", default=4)
+    parser.add_argument(
+        "--language",
+        type=str,
+        help="Language of the TechGuide catalog",
+        choices=LANGUAGES,
+        default=DEFAULT_LANGUAGE,
+    )
+    parser.add_argument(
+        "--job_description",
+        type=str,
+        action="append",
+        help="Job description used as an extra query (requires API_KEY)",
+        default=[],
+    )
+    args = parser.parse_args()
+
+    cards = TechGuideCards.construct(language=args.language)
+    api_paths = TechGuidePaths.construct(language=args.language)
+    derived_paths = TechGuidePaths.construct(language=args.language, derive_layers=True)
+
+    results = evaluate(cards, api_paths, derived_paths, k=args.k)
+    print(f"Layers: {results['layers']}")
+    print(f"Card queries: {results['queries']}")
+    print(f"Mean cosine API x derived: {results['mean_cosine']:.4f}")
+    print(f"Recall@{args.k} API: {results['api_recall']:.4f}")
+    print(f"Recall@{args.k} derived: {results['derived_recall']:.4f}")
+    print(f"Top-{args.k} overlap: {results['top_overlap']:.4f}")
+
+    if args.job_description:
+        from ai import TechGuideAI
+
+        tga = TechGuideAI()
+        for job_description in args.job_description:
+            query = tga.embed_content(job_description)
+            api_top = rank(api_paths.expertises_embeddings, query, args.k)
+            derived_top = rank(derived_paths.expertises_embeddings, query, args.k)
+            print(f"\n{job_description}")
+            print("API:     " + "; ".join(api_paths.expertises[i].identifier for i in api_top))
+            print("Derived: " + "; ".join(derived_paths.expertises[i].identifier for i in derived_top))
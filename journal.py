@@ -0,0 +1,137 @@
+"""
+Journal used by the collector to checkpoint its progress.
+
+Each processed item (parsed card, parsed guide, embedding...) is appended to a SQLite
+database as soon as it is available, so that an interrupted collection can resume
+from where it stopped. Final JSON files are streamed from the journal and replaced
+atomically, keeping memory usage independent of the corpus size.
+"""
+
+import os
+import json
+import sqlite3
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_writer(destination: str):
+    """
+    Open a temporary file that replaces destination only once it is fully written
+    :param destination: Final file path
+    :return:
+    """
+    tmp = destination + ".tmp"
+    try:
+        with open(tmp, "w") as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, destination)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class TechGuideJournal:
+    """
+    Append-only journal of the collector progress, keyed by stage and item key.
+    A connection must not be shared between threads, each thread opens its own.
+    """
+
+    def __init__(self, file: str):
+        """
+
+        :param file: SQLite file of the journal
+        """
+        self.file = file
+        self.connection = sqlite3.connect(file)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            "stage TEXT NOT NULL, key TEXT NOT NULL, value TEXT, "
+            "PRIMARY KEY (stage, key))"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def reset(self):
+        """
+        Forget all the recorded progress
+        :return:
+        """
+        self.connection.execute("DELETE FROM journal")
+        self.connection.commit()
+
+    def record(self, stage: str, key: str, value):
+        """
+        Record an item as done, committing immediately
+        :param stage: Stage name, e.g. "card" or "card_embedding"
+        :param key: Item identifier
+        :param value: JSON serializable value
+        :return:
+        """
+        self.connection.execute(
+            "INSERT OR REPLACE INTO journal (stage, key, value) VALUES (?, ?, ?)",
+            (stage, key, json.dumps(value)),
+        )
+        self.connection.commit()
+
+    def done(self, stage: str, key: str) -> bool:
+        cursor = self.connection.execute(
+            "SELECT 1 FROM journal WHERE stage = ? AND key = ?", (stage, key)
+        )
+        return cursor.fetchone() is not None
+
+    def get(self, stage: str, key: str, default=None):
+        cursor = self.connection.execute(
+            "SELECT value FROM journal WHERE stage = ? AND key = ?", (stage, key)
+        )
+        row = cursor.fetchone()
+        return json.loads(row[0]) if row else default
+
+    def keys(self, stage: str):
+        """
+        Iterate over the keys of a stage, in insertion order
+        :param stage:
+        :return:
+        """
+        cursor = self.connection.execute(
+            "SELECT key FROM journal WHERE stage = ? ORDER BY rowid", (stage,)
+        )
+        for (key,) in cursor:
+            yield key
+
+    def items(self, stage: str):
+        """
+        Iterate over the (key, value) pairs of a stage, in insertion order
+        :param stage:
+        :return:
+        """
+        cursor = self.connection.execute(
+            "SELECT key, value FROM journal WHERE stage = ? ORDER BY rowid", (stage,)
+        )
+        for key, value in cursor:
+            yield key, json.loads(value)
+
+    def dump(self, stage: str, destination: str):
+        """
+        Stream a stage to a JSON object file, replacing destination atomically
+        :param stage:
+        :param destination:
+        :return:
+        """
+        cursor = self.connection.execute(
+            "SELECT key, value FROM journal WHERE stage = ? ORDER BY rowid", (stage,)
+        )
+        with atomic_writer(destination) as f:
+            f.write("{")
+            for i, (key, value) in enumerate(cursor):
+                if i:
+                    f.write(", ")
+                f.write(json.dumps(key))
+                f.write(": ")
+                f.write(value)
+            f.write("}")
@@ -0,0 +1,116 @@
+"""
+Load test of the embedding micro-batching of TechGuideAI against a fake backend.
+
+The fake backend simulates a remote embedding API with a fixed latency per call,
+a small cost per content and a limit of concurrent calls (rate limit). It replaces
+TechGuideAI.embed_contents, so requests go through TechGuideAI.embed_content as in
+the planner. Concurrent clients embed contents calling the backend directly for each
+content, through a new TechGuideAI per request (as plan() does) or through one
+shared TechGuideAI.
+"""
+
+import os
+import time
+import random
+from argparse import ArgumentParser
+from threading import BoundedSemaphore, Lock, Thread
+import numpy as np
+from ai import TechGuideAI
+
+
+class FakeEmbeddingBackend:
+
+    def __init__(self, latency=0.05, latency_per_content=0.0005, concurrency=2):
+        self.latency = latency
+        self.latency_per_content = latency_per_content
+        self.semaphore = BoundedSemaphore(concurrency)
+        self.calls = 0
+        self.lock = Lock()
+
+    def embed_batch(self, contents):
+        with self.semaphore:
+            with self.lock:
+                self.calls += 1
+            time.sleep(self.latency + self.latency_per_content * len(contents))
+        return [[float(len(content)), 1.0] for content in contents]
+
+
+def run(embed, clients, requests_per_client):
+    latencies = []
+    lock = Lock()
+
+    def client(i):
+        for j in range(requests_per_client):
+            content = f"job description {i} {j} " * random.randint(1, 5)
+            start = time.perf_counter()
+            embed(content)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - start
+    return total, np.array(latencies)
+
+
+def report(name, backend, total, latencies):
+    print(
+        f"{name:>12}: {len(latencies) / total:8.1f} req/s | "
+        f"p50 {np.percentile(latencies, 50) * 1000:7.1f} ms | "
+        f"p95 {np.percentile(latencies, 95) * 1000:7.1f} ms | "
+        f"backend calls {backend.calls}"
+    )
+
+
+def use_backend(backend):
+    TechGuideAI.close_batchers()
+    TechGuideAI.embed_contents = lambda self, contents: backend.embed_batch(contents)
+
+
+if __name__ == "__main__":
+
+    parser = ArgumentParser("TechGuide AI - Embedding load test")
+    parser.add_argument("--clients", type=int, help="Concurrent clients", default=32)
+    parser.add_argument("--requests", type=int, help="Requests per client", default=10)
+    parser.add_argument("--batch_window", type=float, help="Batch window in seconds", default=0.01)
+    parser.add_argument("--max_batch_size", type=int, help="Maximum batch size", default=32)
+    parser.add_argument("--max_concurrency", type=int, help="Maximum calls in flight", default=4)
+    args = parser.parse_args()
+
+    # The fake backend never reaches the API
+    os.environ.setdefault("API_KEY", "fake")
+    settings = dict(
+        batch_window=args.batch_window,
+        max_batch_size=args.max_batch_size,
+        max_concurrency=args.max_concurrency,
+    )
+
+    backend = FakeEmbeddingBackend()
+    use_backend(backend)
+    tga = TechGuideAI(**settings)
+    total, latencies = run(
+        lambda content: tga.embed_contents([content])[0], args.clients, args.requests
+    )
+    report("direct", backend, total, latencies)
+
+    backend = FakeEmbeddingBackend()
+    use_backend(backend)
+    total, latencies = run(
+        lambda content: TechGuideAI(**settings).embed_content(content),
+        args.clients,
+        args.requests,
+    )
+    report("per request", backend, total, latencies)
+
+    backend = FakeEmbeddingBackend()
+    use_backend(backend)
+    tga = TechGuideAI(**settings)
+    total, latencies = run(tga.embed_content, args.clients, args.requests)
+    report("shared", backend, total, latencies)
+
+    TechGuideAI.close_batchers()
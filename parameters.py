@@ -2,9 +2,43 @@ import os
 
 DATA_FOLDER = os.path.join(os.path.dirname(__file__), "data")
 TMP_FOLDER = os.path.join(os.path.dirname(__file__), "tmp")
-CARDS_FILE = os.path.join(DATA_FOLDER, "cards.json")
-CARDS_EMBEDDINGS_FILE = os.path.join(DATA_FOLDER, "cards_embedding.json")
-GUIDES_FILE = os.path.join(DATA_FOLDER, "guides.json")
-GUIDES_EMBEDDINGS_FILE = os.path.join(DATA_FOLDER, "guides_embedding.json")
+LANGUAGES = ("pt_BR", "en_US", "es")
+DEFAULT_LANGUAGE = os.environ.get("TECHGUIDE_LANGUAGE", "pt_BR")
+if DEFAULT_LANGUAGE not in LANGUAGES:
+    raise ValueError(
+        f"TECHGUIDE_LANGUAGE must be one of {', '.join(LANGUAGES)}, "
+        f"got {DEFAULT_LANGUAGE}"
+    )
+SHARD_CACHE_SIZE = int(os.environ.get("SHARD_CACHE_SIZE", 2))
+CARDS_FILE = "cards.json"
+CARDS_EMBEDDINGS_FILE = "cards_embedding.json"
+CARDS_NEIGHBORS_FILE = "cards_neighbors.json"
+GUIDES_FILE = "guides.json"
+GUIDES_EMBEDDINGS_FILE = "guides_embedding.json"
 TECHGUIDE_GITHUB = os.environ.get("TECHGUIDE_GITHUB", "alura/techguide")
 BRANCH_NAME = os.environ.get("BRANCH_NAME", "main")
+
+
+def check_language(language: str):
+    """
+    Raise a ValueError when the language is not a supported catalog language
+    :param language:
+    :return:
+    """
+    if language not in LANGUAGES:
+        raise ValueError(
+            f"Language must be one of {', '.join(LANGUAGES)}, got {language!r}"
+        )
+
+
+def shard_file(
+    file_name: str, language: str = DEFAULT_LANGUAGE, data_folder: str = DATA_FOLDER
+):
+    """
+    Path of a catalog file in the shard of a language
+    :param file_name: One of the *_FILE names
+    :param language: Shard language
+    :param data_folder: Data folder holding one sub folder per language
+    :return:
+    """
+    return os.path.join(data_folder, language, file_name)
@@ -2,7 +2,37 @@ from typing import List
 import json
 import numpy as np
 from cards import TechGuideCards
-from parameters import GUIDES_FILE, GUIDES_EMBEDDINGS_FILE
+from parameters import (
+    GUIDES_FILE,
+    GUIDES_EMBEDDINGS_FILE,
+    DEFAULT_LANGUAGE,
+    check_language,
+    shard_file,
+)
+
+
+def guide_card_id(guide_card: dict) -> str:
+    """
+    Card identifier of a guide layer entry
+    :param guide_card: Entry as {"card-id": None, "priority": 10} or {"card-id": {"priority": 10}}
+    :return:
+    """
+    return [key for key in guide_card.keys() if key != "priority"][0]
+
+
+def guide_card_priority(guide_card: dict, default: int = 1) -> int:
+    """
+    Priority of a guide layer entry
+    :param guide_card: Entry as {"card-id": None, "priority": 10} or {"card-id": {"priority": 10}}
+    :param default: Priority used when the entry does not define one
+    :return:
+    """
+    if "priority" in guide_card:
+        return int(guide_card["priority"])
+    value = guide_card[guide_card_id(guide_card)]
+    if isinstance(value, dict) and "priority" in value:
+        return int(value["priority"])
+    return default
 
 
 class TechGuideColumnLayer:
@@ -42,6 +72,23 @@ class TechGuidePath:
             [collaboration.embedding for collaboration in collaborations]
         )
 
+    def set_layer_embeddings(
+        self, expertises_embeddings: np.ndarray, collaborations_embeddings: np.ndarray
+    ):
+        """
+        Replace the layer embeddings. Rows are kept as given, so views of a larger
+        matrix keep following its updates.
+        :param expertises_embeddings: Matrix with one row per expertise
+        :param collaborations_embeddings: Matrix with one row per collaboration
+        :return:
+        """
+        for layer, embedding in zip(self.expertises, expertises_embeddings):
+            layer.embedding = embedding
+        for layer, embedding in zip(self.collaborations, collaborations_embeddings):
+            layer.embedding = embedding
+        self.expertises_embeddings = expertises_embeddings
+        self.collaborations_embeddings = collaborations_embeddings
+
 
 class TechGuidePaths:
 
@@ -58,17 +105,173 @@ class TechGuidePaths:
         self.collaborations_embeddings = np.concatenate(
             [path.collaborations_embeddings for path in paths]
         )
+        self.layer_card_matrix = None
+        self.layer_embeddings = None
+        self._layer_card_matrix_cards = None
+
+    def build_layer_card_matrix(self, cards: TechGuideCards):
+        """
+        Sparse layer x card priority matrix in COO format (rows, cols, priorities).
+        Priorities are normalized at aggregation time, once the cards without
+        embedding are known. Layers are ordered as self.expertises followed by
+        self.collaborations.
+        :param cards: Catalog whose embeddings are aggregated
+        :return:
+        """
+        card_index = {card.card_id: i for i, card in enumerate(cards.cards)}
+        rows, cols, priorities = [], [], []
+        layers = self.expertises + self.collaborations
+        for row, layer in enumerate(layers):
+            for guide_card in layer.cards:
+                card_id = guide_card_id(guide_card)
+                if card_id not in card_index:
+                    continue
+                rows.append(row)
+                cols.append(card_index[card_id])
+                priorities.append(guide_card_priority(guide_card))
+
+        return (
+            np.array(rows, dtype=np.int64),
+            np.array(cols, dtype=np.int64),
+            np.array(priorities, dtype=np.float64),
+            len(layers),
+        )
+
+    def derive_embeddings(self, cards: TechGuideCards, changed: int = None):
+        """
+        Compute layer embeddings locally as priority-weighted, normalized aggregates
+        of the member cards embeddings, instead of embedding the layer text remotely.
+        Cards without embedding do not take part in the priority weights.
+        The layer x card matrix is built once and reused. When only one card changed,
+        only the layers holding it are recomputed, in place.
+        :param cards: Catalog whose embeddings are aggregated
+        :param changed: Index of the only card whose embedding changed, if known
+        :return:
+        """
+        card_embeddings = cards.embeddings
+        full = (
+            changed is None
+            or self._layer_card_matrix_cards is not cards
+            or self.layer_embeddings is None
+            or self.layer_embeddings.shape[1] != card_embeddings.shape[1]
+        )
+        if self._layer_card_matrix_cards is not cards:
+            self.layer_card_matrix = self.build_layer_card_matrix(cards)
+            self._layer_card_matrix_cards = cards
+        rows, cols, priorities, n_layers = self.layer_card_matrix
+
+        if full:
+            affected = np.arange(n_layers)
+        else:
+            affected = np.unique(rows[cols == changed])
+            if len(affected) == 0:
+                return
+            entries = np.isin(rows, affected)
+            rows, cols, priorities = rows[entries], cols[entries], priorities[entries]
+
+        # Positions of the entries rows among the affected layers
+        positions = np.searchsorted(affected, rows)
+        member_embeddings = card_embeddings[cols]
+        weights = priorities * (np.linalg.norm(member_embeddings, axis=1) > 0)
+        totals = np.bincount(positions, weights=weights, minlength=len(affected))
+        weights = np.divide(
+            weights,
+            totals[positions],
+            out=np.zeros_like(weights),
+            where=totals[positions] > 0,
+        )
+
+        aggregated = np.zeros((len(affected), card_embeddings.shape[1]))
+        np.add.at(aggregated, positions, weights[:, None] * member_embeddings)
+
+        norms = np.linalg.norm(aggregated, axis=1, keepdims=True)
+        aggregated = np.divide(
+            aggregated, norms, out=np.zeros_like(aggregated), where=norms > 0
+        )
+
+        if not full:
+            self.layer_embeddings[affected] = aggregated
+            return
+
+        # Every layer and path array is a view of layer_embeddings, so partial
+        # updates written in place reach all of them
+        self.layer_embeddings = aggregated
+        n_expertises = len(self.expertises)
+        self.expertises_embeddings = aggregated[:n_expertises]
+        self.collaborations_embeddings = aggregated[n_expertises:]
+        expertise_start, collaboration_start = 0, n_expertises
+        for path in self.paths:
+            expertise_end = expertise_start + len(path.expertises)
+            collaboration_end = collaboration_start + len(path.collaborations)
+            path.set_layer_embeddings(
+                aggregated[expertise_start:expertise_end],
+                aggregated[collaboration_start:collaboration_end],
+            )
+            expertise_start, collaboration_start = expertise_end, collaboration_end
+
+    def detach(self):
+        """
+        Stop following the embedding updates of the cards the layers are derived from
+        :return:
+        """
+        if self._layer_card_matrix_cards is not None:
+            self._layer_card_matrix_cards.unsubscribe(self.derive_embeddings)
 
     @staticmethod
     def construct(
-        file: str = GUIDES_FILE, embeddings_file: str = GUIDES_EMBEDDINGS_FILE
+        *,
+        language: str = DEFAULT_LANGUAGE,
+        derive_layers: bool = False,
+        file: str = None,
+        embeddings_file: str = None,
+        cards: TechGuideCards = None,
     ):
+        """
+        Read the guides of a language. Shards are loaded on first use and kept in a
+        bounded cache, unless explicit files or cards are given.
+        :param language: Shard language
+        :param derive_layers: Derive the layer embeddings from the language cards
+        :param file: Guides file, defaults to the language shard
+        :param embeddings_file: Layer embeddings file, defaults to the language shard
+        :param cards: Catalog used to derive layer embeddings locally
+        :return:
+        """
+        check_language(language)
+        if file is None and embeddings_file is None and cards is None:
+            # Imported here since the shards module builds on this one
+            from shards import load_shard
+
+            return load_shard(language).paths(derive_layers)
+        if derive_layers and cards is None:
+            cards = TechGuideCards.construct(language=language)
+        return TechGuidePaths.read(
+            file=file or shard_file(GUIDES_FILE, language),
+            embeddings_file=embeddings_file
+            or shard_file(GUIDES_EMBEDDINGS_FILE, language),
+            cards=cards,
+        )
+
+    @staticmethod
+    def read(file: str, embeddings_file: str, cards: TechGuideCards = None):
+        """
+        Read the guides and their layer embeddings.
+        When cards are given, layer embeddings are derived from the cards embeddings
+        and kept up to date whenever cards.update_embedding is called, until detach
+        is called on the returned paths.
+        :param file: Guides file
+        :param embeddings_file: Layer embeddings computed by the collector
+        :param cards: Catalog used to derive layer embeddings locally
+        :return:
+        """
 
         with open(file, "r") as f:
             path_data = json.load(f)
 
-        with open(embeddings_file, "r") as f:
-            embeddings = json.load(f)
+        if cards is None:
+            with open(embeddings_file, "r") as f:
+                embeddings = json.load(f)
+        else:
+            embeddings = {}
 
         paths = []
         for path_id, item in path_data.items():
@@ -79,7 +282,7 @@ class TechGuidePaths:
                 layer = TechGuideColumnLayer(
                     identifier=expertise_item.get("name", ""),
                     cards=expertise_item.get("cards", []),
-                    embedding=_embeddings[i],
+                    embedding=_embeddings[i] if _embeddings else None,
                 )
                 expertises.append(layer)
 
@@ -90,7 +293,7 @@ class TechGuidePaths:
                 layer = TechGuideColumnLayer(
                     identifier=collaboration_item.get("name", ""),
                     cards=collaboration_item.get("cards", []),
-                    embedding=_embeddings[i],
+                    embedding=_embeddings[i] if _embeddings else None,
                 )
                 collaborations.append(layer)
 
@@ -103,4 +306,9 @@ class TechGuidePaths:
             )
             paths.append(path)
 
-        return TechGuidePaths(paths)
+        guide_paths = TechGuidePaths(paths)
+        if cards is not None:
+            guide_paths.derive_embeddings(cards)
+            cards.subscribe(guide_paths.derive_embeddings)
+        return guide_paths
+
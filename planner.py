@@ -1,25 +1,54 @@
 """TechGuide AI Plan"""
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError
 from ai import TechGuideAI
 from paths import TechGuidePaths
 from cards import TechGuideCards
+from parameters import DEFAULT_LANGUAGE, LANGUAGES
 
 
-def plan(job_description, depth=4, availability=8):
+def diversity_weight(value):
+    """
+    Argument type of the diversity weight, a float between 0 and 1
+    :param value:
+    :return:
+    """
+    diversity = float(value)
+    if not 0 <= diversity <= 1:
+        raise ArgumentTypeError(f"diversity must be between 0 and 1, got {value}")
+    return diversity
+
+
+def plan(
+    job_description,
+    depth=4,
+    availability=8,
+    derive_layers=False,
+    diversity=0.0,
+    language=DEFAULT_LANGUAGE,
+    tga=None,
+):
     """
     Plan a study based on a job description
     :param job_description:
     :param depth:
     :param availability:
+    :param derive_layers: Derive the expertise layers embeddings from the cards embeddings
+    :param diversity: Weight of the diversity in the cards selection, between 0 and 1
+    :param language: Language of the TechGuide catalog
+    :param tga: TechGuideAI instance to reuse, a new one is created by default
     :return:
     """
 
+    if not 0 <= diversity <= 1:
+        raise ValueError(f"Diversity must be between 0 and 1, got {diversity}")
+
     # Read TechGuide data
-    cards = TechGuideCards.construct()
-    paths = TechGuidePaths.construct()
+    cards = TechGuideCards.construct(language=language)
+    paths = TechGuidePaths.construct(language=language, derive_layers=derive_layers)
 
-    # Intantiate TechGuide AI
-    tga = TechGuideAI()
+    # Intantiate TechGuide AI, its embedding batcher is shared by all the instances
+    if tga is None:
+        tga = TechGuideAI()
 
     # Collects similar expertises from job_description based on embedding
     similar_expertises = tga.search_similar_expertises(
@@ -31,7 +60,10 @@ def plan(job_description, depth=4, availability=8):
 
     # Collects similar cards from job_description based on embedding
     similar_cards = tga.search_similar_cards(
-        content=job_description, cards=filtered_cards, quantity=availability
+        content=job_description,
+        cards=filtered_cards,
+        quantity=availability,
+        diversity=diversity,
     )
 
     # Use Gemini to redescribe job descrition
@@ -65,10 +97,34 @@ if __name__ == "__main__":
     parser.add_argument(
         "--availability", type=int, help="Number of cards", default=8
     )
+    parser.add_argument(
+        "--derive_layers",
+        action="store_true",
+        help="Derive the expertise layers embeddings from the cards embeddings",
+    )
+    parser.add_argument(
+        "--diversity",
+        type=diversity_weight,
+        help="Weight of the diversity in the cards selection, between 0 and 1",
+        default=0.0,
+    )
+    parser.add_argument(
+        "--language",
+        type=str,
+        help="Language of the TechGuide catalog",
+        choices=LANGUAGES,
+        default=DEFAULT_LANGUAGE,
+    )
     args = parser.parse_args()
 
-    plan(
-        job_description=args.job_description,
-        depth=args.depth,
-        availability=args.availability,
-    )
+    try:
+        plan(
+            job_description=args.job_description,
+            depth=args.depth,
+            availability=args.availability,
+            derive_layers=args.derive_layers,
+            diversity=args.diversity,
+            language=args.language,
+        )
+    except FileNotFoundError as e:
+        parser.error(str(e))
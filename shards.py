@@ -0,0 +1,125 @@
+"""
+Per-language catalog shards loaded on demand.
+
+Each shard keeps the cards of a language together with the guides read from the
+same language, so that layers derived from the cards always follow the cards
+instance served to the callers. Loaded shards are kept in a bounded LRU cache and
+an evicted shard releases its subscriptions.
+"""
+
+import os
+from collections import OrderedDict
+from threading import RLock
+from typing import List
+from cards import TechGuideCards
+from paths import TechGuidePaths
+from parameters import (
+    CARDS_FILE,
+    CARDS_EMBEDDINGS_FILE,
+    CARDS_NEIGHBORS_FILE,
+    DATA_FOLDER,
+    GUIDES_FILE,
+    GUIDES_EMBEDDINGS_FILE,
+    LANGUAGES,
+    SHARD_CACHE_SIZE,
+    check_language,
+    shard_file,
+)
+
+
+def available_languages(data_folder: str = DATA_FOLDER) -> List[str]:
+    """
+    Languages with a shard on disk
+    :param data_folder:
+    :return:
+    """
+    return [
+        language
+        for language in LANGUAGES
+        if os.path.isdir(os.path.join(data_folder, language))
+    ]
+
+
+class TechGuideShard:
+    """
+    Cards and guides of one language
+    """
+
+    def __init__(self, language: str):
+        """
+
+        :param language: Shard language
+        """
+        check_language(language)
+        if not os.path.isdir(os.path.join(DATA_FOLDER, language)):
+            available = ", ".join(available_languages()) or "none"
+            raise FileNotFoundError(
+                f"No catalog shard for language {language} in {DATA_FOLDER} "
+                f"(available: {available}). Run the collector to build it."
+            )
+        self.language = language
+        self.cards = TechGuideCards.read(
+            file=shard_file(CARDS_FILE, language),
+            embeddings_file=shard_file(CARDS_EMBEDDINGS_FILE, language),
+            neighbors_file=shard_file(CARDS_NEIGHBORS_FILE, language),
+        )
+        self._paths = {}
+        self._lock = RLock()
+
+    def paths(self, derive_layers: bool = False) -> TechGuidePaths:
+        """
+        Guides of the shard, read on first use
+        :param derive_layers: Derive the layer embeddings from the shard cards
+        :return:
+        """
+        with self._lock:
+            if derive_layers not in self._paths:
+                self._paths[derive_layers] = TechGuidePaths.read(
+                    file=shard_file(GUIDES_FILE, self.language),
+                    embeddings_file=shard_file(GUIDES_EMBEDDINGS_FILE, self.language),
+                    cards=self.cards if derive_layers else None,
+                )
+            return self._paths[derive_layers]
+
+    def release(self):
+        """
+        Stop the derived layers from following the shard cards
+        :return:
+        """
+        with self._lock:
+            for paths in self._paths.values():
+                paths.detach()
+            self._paths = {}
+
+
+_shards = OrderedDict()
+_lock = RLock()
+
+
+def load_shard(language: str) -> TechGuideShard:
+    """
+    Shard of a language, loaded on first use and kept in a bounded LRU cache
+    :param language:
+    :return:
+    """
+    with _lock:
+        if language in _shards:
+            _shards.move_to_end(language)
+            return _shards[language]
+        shard = TechGuideShard(language)
+        _shards[language] = shard
+        while len(_shards) > SHARD_CACHE_SIZE:
+            _, evicted = _shards.popitem(last=False)
+            evicted.release()
+        return shard
+
+
+def clear_shards():
+    """
+    Empty the shards cache
+    :return:
+    """
+    with _lock:
+        while _shards:
+            _, evicted = _shards.popitem(last=False)
+            evicted.release()
@@ -0,0 +1,136 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+import pytest
+from batcher import TechGuideEmbeddingBatcher
+
+
+class FakeBackend:
+
+    def __init__(self, fail=False, latency=0.01):
+        self.fail = fail
+        self.latency = latency
+        self.batches = []
+        self.lock = Lock()
+
+    def embed_batch(self, contents):
+        with self.lock:
+            self.batches.append(list(contents))
+        time.sleep(self.latency)
+        if self.fail:
+            raise RuntimeError("backend unavailable")
+        return [[float(len(content))] for content in contents]
+
+
+def embed_concurrently(batcher, contents):
+    with ThreadPoolExecutor(max_workers=len(contents)) as executor:
+        futures = [executor.submit(batcher.embed, content) for content in contents]
+        return [future.result(timeout=5) for future in futures]
+
+
+def test_concurrent_requests_are_coalesced():
+    backend = FakeBackend()
+    batcher = TechGuideEmbeddingBatcher(
+        backend.embed_batch, max_batch_size=64, max_wait=0.2
+    )
+    contents = ["x" * i for i in range(1, 21)]
+
+    vectors = embed_concurrently(batcher, contents)
+
+    assert vectors == [[float(len(content))] for content in contents]
+    assert len(backend.batches) < len(contents)
+    assert sum(len(batch) for batch in backend.batches) == len(contents)
+
+
+def test_batches_respect_max_batch_size():
+    backend = FakeBackend()
+    batcher = TechGuideEmbeddingBatcher(
+        backend.embed_batch, max_batch_size=4, max_wait=0.2
+    )
+
+    embed_concurrently(batcher, ["x" * i for i in range(1, 13)])
+
+    assert all(len(batch) <= 4 for batch in backend.batches)
+
+
+def test_duplicate_contents_are_embedded_once():
+    backend = FakeBackend()
+    batcher = TechGuideEmbeddingBatcher(
+        backend.embed_batch, max_batch_size=64, max_wait=0.2
+    )
+
+    vectors = embed_concurrently(batcher, ["same"] * 8)
+
+    assert vectors == [[4.0]] * 8
+    assert all(batch.count("same") == 1 for batch in backend.batches)
+
+
+def test_backend_errors_reach_every_caller():
+    backend = FakeBackend(fail=True)
+    batcher = TechGuideEmbeddingBatcher(
+        backend.embed_batch, max_batch_size=64, max_wait=0.2
+    )
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        futures = [executor.submit(batcher.embed, f"job {i}") for i in range(5)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match="backend unavailable"):
+                future.result(timeout=5)
+
+
+def test_wrong_number_of_embeddings_is_an_error():
+    batcher = TechGuideEmbeddingBatcher(lambda contents: [], max_wait=0.0)
+
+    with pytest.raises(ValueError):
+        batcher.embed("job")
+
+
+def test_non_str_content_is_rejected():
+    batcher = TechGuideEmbeddingBatcher(FakeBackend().embed_batch)
+
+    with pytest.raises(TypeError):
+        batcher.embed(["a", "b"])
+
+
+def test_close_stops_the_batcher_threads():
+    threads_before = threading.active_count()
+    batchers = [
+        TechGuideEmbeddingBatcher(FakeBackend(latency=0).embed_batch, max_wait=0.0)
+        for _ in range(10)
+    ]
+    for batcher in batchers:
+        batcher.embed("job")
+    for batcher in batchers:
+        batcher.close()
+
+    assert threading.active_count() == threads_before
+    with pytest.raises(RuntimeError):
+        batchers[0].embed("job")
+
+
+def test_tech_guide_ai_instances_share_one_batcher(monkeypatch):
+    pytest.importorskip("google.generativeai")
+    from ai import TechGuideAI
+
+    backend = FakeBackend(latency=0.05)
+    monkeypatch.setenv("API_KEY", "fake")
+    monkeypatch.setattr(
+        TechGuideAI, "embed_contents", lambda self, contents: backend.embed_batch(contents)
+    )
+    TechGuideAI.close_batchers()
+    try:
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(
+                    lambda content: TechGuideAI(batch_window=0.2).embed_content(content),
+                    f"job {i}",
+                )
+                for i in range(8)
+            ]
+            vectors = [future.result(timeout=5) for future in futures]
+    finally:
+        TechGuideAI.close_batchers()
+
+    assert vectors == [[5.0]] * 8
+    assert len(backend.batches) < 8